@@ -0,0 +1,459 @@
+"""Databricks I/O helpers for the compliance checker.
+
+Everything that talks to Databricks lives here — SQL statements, job runs,
+and Volume file transfer — so app.py stays pure UI. Connection-shaped
+objects (HTTP session, SQL connection, result cache) are st.cache_resource
+singletons shared by every Streamlit session in the process.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import streamlit as st
+import xlsxwriter
+
+from sql_cache import SQLCache
+
+try:
+    from databricks import sql as dbsql
+except ImportError:
+    dbsql = None  # fall back to the REST Statement Execution API
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import httpx
+    import h2  # noqa: F401 — httpx needs it for http2=True
+except ImportError:
+    httpx = None
+
+def _json(resp):
+    # orjson decodes at C speed — noticeable inside the poll loops, where the
+    # runs/get payload can grow with task state. Falls back to stdlib json.
+    return orjson.loads(resp.content) if orjson is not None else resp.json()
+
+DATABRICKS_INSTANCE = st.secrets["databricks"]["instance"]
+DATABRICKS_TOKEN    = st.secrets["databricks"]["token"]
+JOB_ID              = st.secrets["databricks"]["job_id"]
+WAREHOUSE_ID        = st.secrets["databricks"]["warehouse_id"]
+VOLUME_PATH         = st.secrets["databricks"]["volume_path"]
+ARCHIVE_PATH        = st.secrets["databricks"]["archive_path"]
+# Set archive_in_job = true once the VAT_Checker notebook's final cell does
+# the archive INSERTs + TRUNCATEs itself (it already receives batch_name);
+# the app then skips those five warehouse submissions entirely.
+ARCHIVE_IN_JOB      = bool(st.secrets["databricks"].get("archive_in_job", False))
+# Set archive_copy_in_job = true once the notebook copies the working folder
+# to the archive server-side (dbutils.fs.cp); the app then sends each batch's
+# bytes over the wire exactly once.
+ARCHIVE_COPY_IN_JOB = bool(st.secrets["databricks"].get("archive_copy_in_job", False))
+
+headers = {"Authorization": f"Bearer {DATABRICKS_TOKEN}"}
+
+@st.cache_resource
+def get_sql_cache():
+    # Shared across all sessions of this process; shared across replicas too
+    # when [cache] redis_url is configured in secrets.
+    return SQLCache(st.secrets.get("cache", {}).get("redis_url"))
+
+@st.cache_resource
+def get_sql_connection():
+    # One Thrift connection per process, shared across sessions: binary
+    # protocol + CloudFetch Arrow results, no JSON re-parsing in Python.
+    return dbsql.connect(
+        server_hostname=DATABRICKS_INSTANCE.replace("https://", ""),
+        http_path=f"/sql/1.0/warehouses/{WAREHOUSE_ID}",
+        access_token=DATABRICKS_TOKEN,
+    )
+
+def run_sql(sql: str, params: dict = None):
+    # params maps :name placeholders to string values. Binding them keeps the
+    # SQL text identical across batches (so both this cache and the warehouse
+    # result cache can hit) and avoids f-string injection.
+    cache = get_sql_cache()
+    cache_key = sql if not params else sql + f"\n-- params: {sorted(params.items())}"
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    df = _run_sql_connector(sql, params) if dbsql is not None else _run_sql_rest(sql, params)
+    if df is None:
+        # Warehouse unavailable or query failed: fall back to a stale cached
+        # copy if we have one so the archive tabs still render.
+        stale = cache.get(cache_key, allow_stale=True)
+        return stale if stale is not None else pd.DataFrame()
+    cache.set(cache_key, df)
+    return df
+
+# databricks-sql declares threadsafety = 1 (threads may share the module, but
+# not connections), so the process-wide connection is serialized here. Only
+# the Thrift path needs this; REST statements keep running concurrently.
+_thrift_lock = threading.Lock()
+
+def _run_sql_connector(sql, params):
+    try:
+        with _thrift_lock, get_sql_connection().cursor() as cursor:
+            cursor.execute(sql, parameters=params)
+            if cursor.description is None:  # INSERT/TRUNCATE: no result set
+                return pd.DataFrame()
+            return cursor.fetchall_arrow().to_pandas(types_mapper=pd.ArrowDtype)
+    except Exception:
+        return None
+
+def _execute(sql, params=None):
+    # For writes. run_sql maps a failed statement to an empty DataFrame so
+    # the read-only tabs degrade gracefully; a write that fails must raise
+    # instead so callers never build on a statement that didn't land.
+    df = _run_sql_connector(sql, params) if dbsql is not None else _run_sql_rest(sql, params)
+    if df is None:
+        raise RuntimeError(f"Statement failed: {sql.strip().splitlines()[0]} ...")
+    return df
+
+def _run_sql_rest(sql, params):
+    submit_url = f"{DATABRICKS_INSTANCE}/api/2.0/sql/statements/"
+    # Let the API hold the request server-side (50s is the documented max) so
+    # short statements come back on the initial POST with zero polling.
+    # ARROW_STREAM over external links: the warehouse writes result chunks to
+    # presigned cloud storage and we decode them with PyArrow, instead of the
+    # API inlining JSON cells that get re-parsed one at a time in Python.
+    payload = {
+        "statement": sql,
+        "warehouse_id": WAREHOUSE_ID,
+        "wait_timeout": "50s",
+        "on_wait_timeout": "CONTINUE",
+        "disposition": "EXTERNAL_LINKS",
+        "format": "ARROW_STREAM",
+    }
+    if params:
+        payload["parameters"] = [
+            {"name": k, "value": str(v), "type": "STRING"} for k, v in params.items()
+        ]
+    res = _json(get_session().post(submit_url, json=payload))
+    if "statement_id" not in res:
+        return None
+    statement_id = res["statement_id"]
+
+    # Only statements still PENDING/RUNNING after the long-poll need re-polling;
+    # back off exponentially but stay responsive (0.25s -> 2s cap).
+    attempt = 0
+    while res["status"]["state"] not in ["SUCCEEDED", "FAILED", "CANCELED"]:
+        time.sleep(min(0.25 * 2 ** attempt, 2.0))
+        attempt += 1
+        res = _json(get_session().get(f"{submit_url}{statement_id}"))
+
+    if res["status"]["state"] != "SUCCEEDED":
+        return None
+    result = res.get("result", {})
+    if "external_links" in result:
+        links = list(result["external_links"])
+        # Large results span multiple chunks; walk the chain before fetching.
+        while links and links[-1].get("next_chunk_internal_link"):
+            nxt = _json(get_session().get(
+                f"{DATABRICKS_INSTANCE}{links[-1]['next_chunk_internal_link']}"
+            ))
+            links.extend(nxt.get("external_links", []))
+        df = _fetch_arrow_links(links).to_pandas(types_mapper=pd.ArrowDtype)
+    elif "data_array" in result:
+        # Inline JSON fallback for workspaces without cloud-fetch. A given
+        # column's cells are always either all dicts or all scalars, so
+        # classify each column once from the first row instead of paying an
+        # isinstance branch per cell, then extract column-major — a dict of
+        # lists is also the cheapest DataFrame constructor (no transpose).
+        cols = [c["name"] for c in res["manifest"]["schema"]["columns"]]
+        data_array = result["data_array"]
+        if not data_array:
+            df = pd.DataFrame(columns=cols)
+        else:
+            row0 = data_array[0]
+            extractors = [
+                (lambda c: c["value"]) if isinstance(row0[i], dict) else (lambda c: c)
+                for i in range(len(cols))
+            ]
+            columns = [
+                [extract(r[i]) for r in data_array]
+                for i, extract in enumerate(extractors)
+            ]
+            df = pd.DataFrame(dict(zip(cols, columns)))
+    else:
+        df = pd.DataFrame()
+    return df
+
+def _fetch_arrow_links(links):
+    # The external links are presigned cloud-storage URLs: fetch them bare
+    # (no auth header) and in parallel, then decode each Arrow stream in C++.
+    def fetch(link):
+        resp = requests.get(link["external_link"], stream=True)
+        resp.raise_for_status()
+        return pa.ipc.open_stream(resp.raw).read_all()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        tables = list(executor.map(fetch, links))
+    return pa.concat_tables(tables)
+
+def _ok(resp):
+    # requests has .ok, httpx has .is_success — status_code works for both.
+    return resp.status_code < 400
+
+if httpx is not None:
+    class _RetryTransport(httpx.HTTPTransport):
+        # httpx's built-in retries= only covers connect errors; this adds the
+        # same 429/5xx re-sends (and backoff factor) urllib3's Retry gives the
+        # requests fallback, so swapping clients doesn't lose the healing on
+        # Databricks rate limits and transient server errors.
+        RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+        def handle_request(self, request):
+            response = super().handle_request(request)
+            # Chunked bodies are one-shot generators (the big uploads) and
+            # can't be replayed, so only retry replayable requests.
+            if request.headers.get("transfer-encoding") == "chunked":
+                return response
+            for attempt in range(3):
+                if response.status_code not in self.RETRY_STATUSES:
+                    break
+                response.close()
+                time.sleep(0.3 * 2 ** attempt)
+                response = super().handle_request(request)
+            return response
+
+@st.cache_resource
+def get_session():
+    # One pooled client per process, shared across user sessions and reruns:
+    # keep-alive skips the TCP+TLS handshake on every Databricks call. With
+    # httpx+h2 installed, HTTP/2 multiplexes the many small poll/delete calls
+    # and the concurrent uploads over a single TLS connection instead of one
+    # pool slot each; otherwise a retrying requests.Session does HTTP/1.1
+    # keep-alive.
+    if httpx is not None:
+        return httpx.Client(
+            headers=headers,
+            timeout=60.0,
+            # limits= on the Client is ignored when an explicit transport is
+            # passed, so the pool settings live on the transport itself.
+            transport=_RetryTransport(
+                http2=True,
+                retries=3,
+                limits=httpx.Limits(max_keepalive_connections=16, keepalive_expiry=60.0),
+            ),
+        )
+    s = requests.Session()
+    s.headers.update(headers)
+    s.mount("https://", HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        # Retry rate-limit and transient server errors too, not just
+        # connection failures — Databricks answers 429/5xx under load.
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+        ),
+    ))
+    return s
+
+UPLOAD_CHUNK = 1024 * 1024  # 1 MB slices for chunked transfer of big PDFs
+
+def _iter_chunks(buf):
+    for i in range(0, len(buf), UPLOAD_CHUNK):
+        yield buf[i:i + UPLOAD_CHUNK]
+
+def upload_to_volume(file_name, file_buffer, dest_path):
+    # file_buffer is a memoryview over the UploadedFile's buffer, so both the
+    # working and archive PUTs stream the same bytes without copying them onto
+    # the Python heap. Files over 10 MB go out as 1 MB chunks so sending
+    # starts immediately instead of after a full materialization.
+    url = f"{DATABRICKS_INSTANCE}/api/2.0/fs/files{dest_path}/{file_name}"
+    session = get_session()
+    if httpx is not None:
+        # httpx streams any bytes iterator; yield fixed-size copies so the
+        # HTTP/2 layer sees plain bytes frames.
+        resp = session.put(url, content=(bytes(c) for c in _iter_chunks(file_buffer)))
+    else:
+        body = _iter_chunks(file_buffer) if len(file_buffer) > 10 * UPLOAD_CHUNK else file_buffer
+        resp = session.put(url, data=body)
+    resp.raise_for_status()
+
+def run_parse_job(batch_name: str):
+    url = f"{DATABRICKS_INSTANCE}/api/2.1/jobs/run-now"
+    resp = get_session().post(
+        url,
+        json={
+            "job_id": JOB_ID,
+            "notebook_params": {"batch_name": batch_name}
+        }
+    )
+    if not _ok(resp):
+        st.write("Error status code:", resp.status_code)
+        try:
+            st.write("Error body:", resp.json())
+        except:
+            st.write("Error body not JSON:", resp.text)
+        resp.raise_for_status()
+    return _json(resp)["run_id"]
+
+def wait_for_result(run_id):
+    # include_history=false keeps the poll payload small (no repair history).
+    url = f"{DATABRICKS_INSTANCE}/api/2.1/jobs/runs/get?run_id={run_id}&include_history=false"
+    # Fibonacci backoff (1,1,2,3,5,5,... capped at 5s): sub-second detection
+    # for short runs without hammering the Jobs API on long ones.
+    a, b = 1, 1
+    while True:
+        resp = _json(get_session().get(url))
+        if resp["state"]["life_cycle_state"] == "TERMINATED":
+            return resp
+        time.sleep(min(a, 5))
+        a, b = b, a + b
+
+ARCHIVE_TABLES = (
+    "dev_uc_catalog.default.zatca_invoices_head_archive",
+    "dev_uc_catalog.default.zatca_checks_flat_archive",
+)
+
+def _invalidate_run_caches():
+    # After a batch run the live-table entries are wrong and the archive
+    # batch lists just grew. get_batch_list.clear() only empties the
+    # Streamlit layer; the batch-list SELECTs carry TTL_LONG in SQLCache
+    # (they match "ARCHIVE"), so their keys must be busted explicitly or a
+    # fresh batch stays missing from the dropdowns for up to five minutes.
+    cache = get_sql_cache()
+    cache.invalidate_short()
+    for table in ARCHIVE_TABLES:
+        cache.invalidate(_batch_list_sql(table))
+    get_batch_list.clear()
+
+def archive_and_reset(batch_name):
+    if ARCHIVE_IN_JOB:
+        # The notebook already archived and reset as its final cell; the
+        # app only needs to drop its now-stale cache entries.
+        _invalidate_run_caches()
+        return
+    # The Statement Execution API runs one statement per call, so the archive
+    # and reset can't ship as a single BEGIN...COMMIT batch. Pipeline instead:
+    # the two archive INSERTs touch disjoint tables and run concurrently, as
+    # do the three TRUNCATEs once both inserts have landed. That turns five
+    # serial submit->poll round-trips into two.
+    # :batch is bound rather than interpolated: the statement text stays
+    # constant across runs (reusable plan) and a hostile batch name can't
+    # break out of the literal.
+    inserts = [
+        """
+        INSERT INTO dev_uc_catalog.default.zatca_invoices_head_archive
+        SELECT *, :batch AS batch_name
+        FROM dev_uc_catalog.default.zatca_invoices_head
+        """,
+        """
+        INSERT INTO dev_uc_catalog.default.zatca_checks_flat_archive
+        SELECT *, :batch AS batch_name
+        FROM dev_uc_catalog.default.zatca_checks_flat
+        """,
+    ]
+    truncates = [
+        "TRUNCATE TABLE dev_uc_catalog.default.zatca_invoices_head",
+        "TRUNCATE TABLE dev_uc_catalog.default.zatca_checks_flat",
+        "TRUNCATE TABLE dev_uc_catalog.default.zatca_invoice_check_parsed",
+    ]
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [
+            executor.submit(_execute, sql, {"batch": batch_name}) for sql in inserts
+        ]
+        # _execute raises on failure, so a batch whose archive INSERT didn't
+        # land is never truncated away underneath it.
+        for fut in futures:
+            fut.result()
+        list(executor.map(_execute, truncates))
+    _invalidate_run_caches()
+
+def df_to_excel(df_dict):
+    output = BytesIO()
+    # Raw xlsxwriter instead of pandas' to_excel: write_row streams each
+    # tuple straight into the sheet, skipping pandas' per-cell formatting
+    # machinery, and constant_memory spools each row to a temp file as it's
+    # written so workbook memory stays O(columns) however large the
+    # failed-checks sheet gets. (Don't add in_memory: xlsxwriter turns
+    # constant_memory back off when both are set.) Rows must arrive in
+    # order, which the ORDER BY on the source queries already guarantees.
+    workbook = xlsxwriter.Workbook(output, {
+        "constant_memory": True,
+        "nan_inf_to_errors": True,
+    })
+    for sheet, df in df_dict.items():
+        worksheet = workbook.add_worksheet(sheet)
+        worksheet.write_row(0, 0, df.columns)
+        # Missing values become None so xlsxwriter writes blank cells.
+        safe = df.astype(object).where(df.notna(), None)
+        for i, row in enumerate(safe.itertuples(index=False), 1):
+            worksheet.write_row(i, 0, row)
+    workbook.close()
+    return output.getvalue()
+
+def df_to_csv_bytes(df):
+    # PyArrow's C++ CSV writer goes straight from columns to bytes — no
+    # row-at-a-time Python formatting and no intermediate str that gets
+    # re-encoded to utf-8. Zero-copy when the frame is already Arrow-backed.
+    buf = pa.BufferOutputStream()
+    pa.csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+    return buf.getvalue().to_pybytes()
+
+def _batch_list_sql(table):
+    # Shared with _invalidate_run_caches, which needs the exact statement
+    # text to compute the SQLCache key it busts.
+    return f"SELECT DISTINCT batch_name FROM {table} ORDER BY batch_name DESC"
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_batch_list(table):
+    # The batch list only changes when a new run is archived, so cache it
+    # across reruns; archive_and_reset busts it explicitly.
+    return run_sql(_batch_list_sql(table))
+
+def cleanup_volume(path, batch_name, session):
+    # Runs on a background thread after the batch is archived, so the session
+    # (and anything else Streamlit-bound) is resolved by the caller and passed
+    # in. The user never waits on these deletes.
+    batch_folder = f"{path}/{batch_name}"
+
+    # First choice: one recursive directory delete instead of list + N
+    # per-file round-trips.
+    resp = session.delete(
+        f"{DATABRICKS_INSTANCE}/api/2.0/fs/directories{batch_folder}?recursive=true"
+    )
+    if _ok(resp) or resp.status_code == 404:
+        return f"Deleted batch folder {batch_folder}"
+
+    # Fallback for workspaces that reject the recursive delete: list once,
+    # delete the files in parallel, then remove the (now empty) folder.
+    list_url = f"{DATABRICKS_INSTANCE}/api/2.0/fs/files{batch_folder}"
+    resp = session.get(list_url)
+    if resp.status_code == 404:
+        return f"Batch folder {batch_folder} not found"
+    resp.raise_for_status()
+
+    files = resp.json().get("files", [])
+    if not files:
+        return f"No files in batch folder {batch_folder}"
+
+    def delete_file(f):
+        return _ok(session.delete(f"{DATABRICKS_INSTANCE}/api/2.0/fs/files{f['path']}"))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        outcomes = list(executor.map(delete_file, files))
+    deleted = sum(outcomes)
+    failed = len(outcomes) - deleted
+
+    # Finally try to delete the folder itself
+    session.delete(f"{DATABRICKS_INSTANCE}/api/2.0/fs/directories{batch_folder}")
+
+    msg = f"Deleted {deleted} files"
+    if failed > 0:
+        msg += f", {failed} failed"
+    msg += f" in {batch_folder}"
+    return msg
@@ -0,0 +1,118 @@
+"""Shared cache for read-only SQL results.
+
+st.cache_data is per-process, so every Streamlit replica behind a load
+balancer re-runs the same SELECTs against the SQL Warehouse, and caching
+run_sql wholesale also "caches" INSERT/TRUNCATE calls as empty DataFrames.
+This cache only ever stores SELECT results, keyed by a hash of the SQL text,
+and uses a Redis backend when `[cache] redis_url` is set in secrets so all
+replicas share one copy. Without Redis it degrades to a per-process dict.
+
+Entries are kept past their TTL so tabs can still render a stale copy when
+the warehouse is unreachable (pass allow_stale=True on the second lookup).
+"""
+
+import hashlib
+import pickle
+import time
+
+# TTL tiers (seconds): the live zatca_* tables change on every batch run, the
+# archive tables only ever grow, so they can be cached far longer.
+TTL_SHORT = 10
+TTL_LONG = 300
+STALE_KEEP = 3600  # how long expired entries stay around for stale fallback
+
+
+def is_cacheable(sql):
+    return sql.lstrip().upper().startswith("SELECT")
+
+
+def ttl_for(sql):
+    return TTL_LONG if "ARCHIVE" in sql.upper() else TTL_SHORT
+
+
+def _key(sql):
+    return "sqlcache:" + hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+class SQLCache:
+    def __init__(self, redis_url=None):
+        self._redis = None
+        self._local = {}  # key -> (expires_at, ttl, pickled df)
+        if redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(redis_url)
+                self._redis.ping()
+            except Exception:
+                # Redis missing/unreachable: fall back to the local dict.
+                self._redis = None
+
+    def get(self, sql, allow_stale=False):
+        if not is_cacheable(sql):
+            return None
+        key = _key(sql)
+        if self._redis is not None:
+            try:
+                suffix = ":stale" if allow_stale else ""
+                blob = self._redis.get(key + suffix)
+                return pickle.loads(blob) if blob else None
+            except Exception:
+                return None
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        expires_at, _ttl, blob = entry
+        if time.time() > expires_at and not allow_stale:
+            return None
+        return pickle.loads(blob)
+
+    def set(self, sql, df):
+        if not is_cacheable(sql):
+            return
+        key = _key(sql)
+        ttl = ttl_for(sql)
+        blob = pickle.dumps(df)
+        if self._redis is not None:
+            try:
+                self._redis.setex(key, ttl, blob)
+                self._redis.setex(key + ":stale", STALE_KEEP, blob)
+                if ttl == TTL_SHORT:
+                    self._redis.sadd("sqlcache:short_keys", key)
+            except Exception:
+                pass
+            return
+        # Opportunistic eviction, mirroring Redis expiry: entries past their
+        # stale window are useless, and without this every browsed archive
+        # batch would pin its pickled DataFrame for the process lifetime.
+        now = time.time()
+        self._local = {
+            k: v for k, v in self._local.items() if now <= v[0] + STALE_KEEP
+        }
+        self._local[key] = (now + ttl, ttl, blob)
+
+    def invalidate(self, sql):
+        """Drop one statement's entry, fresh and stale copies both."""
+        key = _key(sql)
+        if self._redis is not None:
+            try:
+                self._redis.delete(key, key + ":stale")
+            except Exception:
+                pass
+            return
+        self._local.pop(key, None)
+
+    def invalidate_short(self):
+        """Drop short-TTL entries; called after the TRUNCATE reset so the
+        next summary query never shows a pre-reset result."""
+        if self._redis is not None:
+            try:
+                keys = self._redis.smembers("sqlcache:short_keys")
+                if keys:
+                    self._redis.delete(*keys, *[k + b":stale" for k in keys])
+                self._redis.delete("sqlcache:short_keys")
+            except Exception:
+                pass
+            return
+        self._local = {
+            k: v for k, v in self._local.items() if v[1] != TTL_SHORT
+        }
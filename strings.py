@@ -0,0 +1,74 @@
+"""UI strings for both languages.
+
+Kept out of app.py so the two full language tables are parsed once per
+process (app.py re-executes top to bottom on every rerun).
+"""
+
+STRINGS = {
+    "en": {
+        "title": "🚗 Invoice Compliance Checker",
+        "main_tab": "📥 New Compliance Check",
+        "inv_tab": "📂 Archived Invoices",
+        "fail_tab": "📂 Archived Failed Checks",
+        "password_prompt": "🔑 Enter password to access this section",
+        "finance_prompt": "Finance-only access. Please enter the finance password in Tab 1.",
+        "logout": "🚪 Logout",
+        "batch_name": "📦 Enter a batch name (optional)",
+        "upload_label": "Upload up to 8 invoice PDFs",
+        "received": "Received {n} file(s).",
+        "too_big": "{n} file(s) exceed {mb} MB and were skipped: {files}",
+        "run_check": "🚀 Run VAT Compliance Check",
+        "summary": "📄 Invoice Summary",
+        "failed": "⚠️ Failed Checks",
+        "all_passed": "🎉 All invoices passed compliance checks!",
+        "export": "📥 Export Results",
+        "download_excel": "⬇️ Download Excel",
+        "download_inv_csv": "⬇️ Download Invoices Archive CSV",
+        "download_fail_csv": "⬇️ Download Checks Archive CSV",
+        "no_archives": "No archived data found yet.",
+        "connection_ok": "✅ SQL Warehouse connected! Today's date = {date}",
+        "connection_fail": "❌ SQL Warehouse test failed.",
+        "wrong_password": "❌ Incorrect password. Please try again.",
+        "disclaimer": """
+---
+⚠️ **Disclaimer:**  
+This program is a **proof-of-concept tool**.  
+- Results may be inaccurate or incomplete.  
+- It does **not** validate electronic VAT **QR codes** or **UBL XML** compliance.  
+For official ZATCA compliance, always use certified solutions.
+"""
+    },
+    "ar": {
+        "title": "🚗 أداة التحقق من مطابقة الفواتير",
+        "main_tab": "📥 التحقق من الفواتير الجديدة",
+        "inv_tab": "📂 الفواتير المؤرشفة",
+        "fail_tab": "📂 الإخفاقات المؤرشفة",
+        "password_prompt": "🔑 أدخل كلمة المرور للوصول إلى هذا القسم",
+        "finance_prompt": "الوصول خاص بقسم المالية. يرجى إدخال كلمة مرور المالية في التبويب الأول.",
+        "logout": "🚪 تسجيل الخروج",
+        "batch_name": "📦 أدخل اسم الدفعة (اختياري)",
+        "upload_label": "قم برفع ما يصل إلى 8 ملفات PDF للفواتير",
+        "received": "تم استلام {n} ملف(ات).",
+        "too_big": "{n} ملف(ات) تتجاوز {mb} ميغابايت وتم تجاهلها: {files}",
+        "run_check": "🚀 تشغيل التحقق من مطابقة ضريبة القيمة المضافة",
+        "summary": "📄 ملخص الفواتير",
+        "failed": "⚠️ الفحوصات الفاشلة",
+        "all_passed": "🎉 جميع الفواتير اجتازت التحقق من المطابقة!",
+        "export": "📥 تنزيل النتائج",
+        "download_excel": "⬇️ تنزيل ملف Excel",
+        "download_inv_csv": "⬇️ تنزيل أرشيف الفواتير CSV",
+        "download_fail_csv": "⬇️ تنزيل أرشيف الإخفاقات CSV",
+        "no_archives": "لا توجد بيانات مؤرشفة حتى الآن.",
+        "connection_ok": "✅ تم الاتصال بـ SQL Warehouse! تاريخ اليوم = {date}",
+        "connection_fail": "❌ فشل اختبار الاتصال بـ SQL Warehouse.",
+        "wrong_password": "❌ كلمة المرور غير صحيحة. يرجى المحاولة مرة أخرى.",
+        "disclaimer": """
+---
+⚠️ **تنويه:**  
+هذه الأداة مجرد **إثبات مفهوم**.  
+- قد تكون النتائج غير دقيقة أو غير كاملة.  
+- لا تتحقق من **رموز QR الإلكترونية** أو **UBL XML** الخاصة بضريبة القيمة المضافة.  
+للحصول على مطابقة رسمية مع هيئة الزكاة والضريبة والجمارك، يرجى استخدام الحلول المعتمدة.
+"""
+    }
+}